@@ -70,6 +70,7 @@ settings = {    #These are defaults. Overriden by settings.json file
     "move_images": True,
     "rename_images": True,
     "label_images": False,
+    "incremental": False,
     "stealth": True
 }
 #================================================================================
@@ -102,7 +103,7 @@ def log_err(log):
 def read_settings():
     if os.path.exists("settings.json"):
         global settings 
-        settings = dict(json.load(open('settings.json')))
+        settings = {**settings, **dict(json.load(open('settings.json')))}    #Keys missing from older settings.json keep their defaults
         log_run(" [INFO] Settings read from settings.json")
     else:
         log_run(" [INFO] settings.json not present")
@@ -130,6 +131,7 @@ def display_banner():
  Move Images :                   {"Yes" if settings["move_images"] else "No"}
  Rename Images :                 {"Yes" if settings["rename_images"] else "No"}
  Label Images :                  {"Yes" if settings["label_images"] else "No"}
+ Incremental Mode :              {"Yes" if settings["incremental"] else "No"}
 
  Preferences can be changed via the settings.json file
  """)
@@ -319,7 +321,7 @@ def compute_hash(imagePaths):
         print("")
         return hashes
 
-def delete_duplicates(imagePaths):
+def delete_duplicates(imagePaths, known_hashes=()):
     if settings["remove_duplicate"]:
         err = 0
         try:
@@ -327,10 +329,11 @@ def delete_duplicates(imagePaths):
             index, tot = 1, 0
             for (h, hashedPaths) in hashes.items():
                 try:
-                    # check to see if there is more than one image with the same hash
-                    if len(hashedPaths) > 1:
-                        tot = tot + len(hashedPaths[1:])
-                        for p in hashedPaths[1:]:       #delete all except one copy
+                    # delete all except one copy, or every copy if the image is already in the finalized dataset
+                    duplicates = hashedPaths if str(h) in known_hashes else hashedPaths[1:]
+                    if duplicates:
+                        tot = tot + len(duplicates)
+                        for p in duplicates:
                             os.remove(p)
                             print(f" Deleting Duplicates: {index}/{tot}", end="\r")
                             index = index + 1
@@ -405,6 +408,10 @@ def resize_images(imagePaths):
             for index, imagePath in enumerate(imagePaths, start=1):
                 try:
                     img = Image.open(imagePath)
+                    if img.size == (settings["image_dimension"], settings["image_dimension"]):
+                        img.close()     #Already resized, saving again only adds JPEG loss
+                        print(f" Resizing Images: {index}/{len(imagePaths)}", end="\r")
+                        continue
                     img = make_square(img)
                     img = img.resize((settings["image_dimension"], settings["image_dimension"]))
                     img.save(imagePath, 'JPEG', quality=85)
@@ -581,6 +588,145 @@ def rename_images(imagePaths, target_folder, name):
         print(" Image renaming disabled. Skipping...")
     print("")
 
+def load_manifest(target_folder):
+    manifest_path = os.path.join(target_folder, 'manifest.json')
+    try:
+        #A pending marker means an incremental run was interrupted while appending images
+        if os.path.exists(manifest_path) and not os.path.exists(manifest_path + '.pending'):
+            try:
+                with open(manifest_path) as f:
+                    hashes = set(json.load(f)["hashes"])
+                log_run(f" [INFO] Manifest read, finalized images: {len(hashes)}")
+                return hashes
+            except KeyboardInterrupt:
+                raise KeyboardInterrupt()
+            except Exception as e:
+                print(f"\n [WARN] Manifest unreadable, it will be rebuilt")
+                log_err(f"[ERR] [in manifest] {e}\n")
+
+        #Manifest missing or not trusted, hash the finalized images once
+        imagePaths = glob.glob(os.path.join(target_folder, "*.jpg"))
+        for set_folder in ['train', 'valid', 'test']:
+            imagePaths += glob.glob(os.path.join(target_folder, set_folder, "*.jpg"))
+        print(" Indexing existing dataset...")
+        hashes = set(str(h) for h in compute_hash(imagePaths))
+        if not save_manifest(target_folder, hashes):
+            return None
+        if os.path.exists(manifest_path + '.pending'):
+            os.remove(manifest_path + '.pending')
+        return hashes
+    except KeyboardInterrupt:
+        raise KeyboardInterrupt()
+    except Exception as e:
+        print(f"\n [ERR] {e}")
+        log_err(f"[ERR] [MAJOR] {e}\n\n")
+        return None
+
+def save_manifest(target_folder, hashes):
+    try:
+        if not os.path.exists(target_folder) :
+            os.makedirs(target_folder)
+        manifest_path = os.path.join(target_folder, 'manifest.json')
+        #Written to a temporary file first so a partial write never replaces the manifest
+        with open(manifest_path + '.tmp', "w") as f :
+            json.dump({"hashes": sorted(hashes)}, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        log_run(f" [INFO] Manifest saved, finalized images: {len(hashes)}")
+        return True
+    except KeyboardInterrupt:
+        raise KeyboardInterrupt()
+    except Exception as e:
+        print(f"\n [ERR] {e}")
+        log_err(f"[ERR] [MAJOR] {e}\n\n")
+        return False
+
+def remove_manifest(target_folder):
+    #A full run adds images without recording their hashes, the manifest is rebuilt on the next incremental run
+    for manifest_path in [os.path.join(target_folder, 'manifest.json'), os.path.join(target_folder, 'manifest.json.pending')]:
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+    log_run(f" [INFO] Manifest removed")
+
+def next_image_index(image_folder, name):
+    index = 0
+    #Annotations (.xml, .txt) left behind by deleted images also reserve their number
+    for imagePath in glob.glob(os.path.join(image_folder, "*")):
+        match = re.match(re.escape(name) + r'_\((\d+)\)\.[^.]+$', os.path.basename(imagePath))
+        if match:
+            index = max(index, int(match.group(1)))
+    return index + 1
+
+def append_image_set(imagePaths, image_folder, set_name, name):
+    err = 0
+    moved = []
+    try:
+        if not os.path.exists(image_folder) :
+            os.makedirs(image_folder)
+        index = next_image_index(image_folder, name)
+
+        for i, imagePath in enumerate(imagePaths, start=1):
+            try:
+                if settings["rename_images"]:
+                    shutil.move(imagePath, os.path.join(image_folder, name+'_('+str(index)+').jpg'))
+                    index += 1
+                else:
+                    shutil.move(imagePath, image_folder)
+                moved.append(imagePath)
+                print(f" Appending images to{set_name}: {i}/{len(imagePaths)}", end="\r")
+            except KeyboardInterrupt:
+                raise KeyboardInterrupt()
+            except Exception as e:
+                log_err(f"[ERR] {e}\n")
+                err += 1
+    except KeyboardInterrupt:
+        raise KeyboardInterrupt()
+    except Exception as e:
+        print(f"\n [ERR] {e}")
+        log_err(f"[ERR] [MAJOR] {e}\n\n")
+    finally:
+        log_run(f" [INFO] Images appended to{set_name}")
+        if err:
+            print(f"\n Images not appended: {err}")
+        print("")
+        return moved
+
+def append_images(imagePaths, target_folder, name, known_hashes):
+    try:
+        #Only the new images are hashed, existing files and their labels are never touched
+        new_hashes = {}
+        for (h, hashedPaths) in compute_hash(imagePaths).items():
+            for p in hashedPaths:
+                new_hashes[p] = str(h)
+        #Images that could not be hashed are left in incoming, they would be invisible to future dedup
+        files = [p for p in imagePaths if p in new_hashes]
+        if len(files) < len(imagePaths):
+            print(f" Images left in incoming (hash error): {len(imagePaths) - len(files)}")
+        random.shuffle(files)
+
+        #Marker is removed only once the manifest records every moved image, else the next run rebuilds it
+        pending_path = os.path.join(target_folder, 'manifest.json.pending')
+        open(pending_path, "w").close()
+
+        moved = []
+        if not settings["move_images"]:
+            moved += append_image_set(files, target_folder, " dataset", name)
+        else:
+            valid_cnt = math.floor(float(settings["image_distribution"].split('/')[1])/100 * len(files))
+            test_cnt = math.floor(float(settings["image_distribution"].split('/')[2])/100 * len(files))
+
+            moved += append_image_set(files[:valid_cnt], os.path.join(target_folder, 'valid'), " valid", name)
+            moved += append_image_set(files[valid_cnt:valid_cnt+test_cnt], os.path.join(target_folder, 'test'), " test", name)
+            moved += append_image_set(files[valid_cnt+test_cnt:], os.path.join(target_folder, 'train'), " train", name)
+
+        if save_manifest(target_folder, known_hashes | set(new_hashes[p] for p in moved)):
+            os.remove(pending_path)
+    except KeyboardInterrupt:
+        raise KeyboardInterrupt()
+    except Exception as e:
+        print(f"\n [ERR] {e}")
+        log_err(f"[ERR] [MAJOR] {e}\n\n")
+    print("")
+
 def label_image_set(target_folder, name):
     try:
         if name:
@@ -636,6 +782,10 @@ def main():
     display_banner()
     keywords = get_keywords()
     target_folder = os.path.join('dataset', keywords[0])
+    if settings["incremental"]:
+        incremental_main(keywords, target_folder)
+        return
+    remove_manifest(target_folder)
     download_images(keywords,target_folder)
     if glob.glob(os.path.join(target_folder, "*.jpg")):
         delete_duplicates(glob.glob(os.path.join(target_folder, "*.jpg")))
@@ -649,6 +799,27 @@ def main():
         print(" [WARN] No Images to process")
         log_run(" [WARN] No Images to process")
 
+def incremental_main(keywords, target_folder):
+    #New downloads are staged in 'incoming' so that only they go through the pipeline
+    staging_folder = os.path.join(target_folder, 'incoming')
+    download_images(keywords, staging_folder)
+    if glob.glob(os.path.join(staging_folder, "*.jpg")):
+        known_hashes = load_manifest(target_folder)
+        if known_hashes is None:
+            print(" [WARN] Existing dataset could not be indexed. Aborting incremental run")
+            log_run(" [WARN] Existing dataset could not be indexed. Aborting incremental run")
+            return
+        #Resized before deduplication so hashes are comparable with the finalized images
+        resize_images(glob.glob(os.path.join(staging_folder, "*.jpg")))
+        delete_duplicates(glob.glob(os.path.join(staging_folder, "*.jpg")), known_hashes)
+        clean_image(staging_folder)
+        mirror_images(glob.glob(os.path.join(staging_folder, "*.jpg")))
+        append_images(glob.glob(os.path.join(staging_folder, "*.jpg")), target_folder, keywords[0], known_hashes)
+        label_images(os.path.abspath(target_folder))
+    else:
+        print(" [WARN] No new Images to process")
+        log_run(" [WARN] No new Images to process")
+
 if __name__=='__main__':
     try:
         tic = time.time()